@@ -1,34 +1,109 @@
 # all_agents.py
 # This file contains all agent classes with the correct async structure.
 
-from api_helpers import call_gemini_api, encode_image_to_base64, get_market_data_from_gov_api, get_weather_from_api
-import json
+from api_helpers import ApiError, is_model_answer, call_gemini_api, stream_gemini_api, prepare_image_file, get_market_data_from_gov_api, get_weather_from_api
+from bridge import Msg
+from cache import ResponseCache, cached_llm, make_key
+import orjson
 import asyncio
 
+# Prompts are split into a fixed PERSONA (sent as the system instruction) and a short
+# PROMPT_TEMPLATE built once at class level; each call only fills it with format_map.
+LANGUAGE_INSTRUCTION = "IMPORTANT: Provide the entire response in the following language: {lang}."
+
 class CropAgent:
+    PERSONA = """
+    You are an expert agronomist specializing in crop diseases in India.
+    Analyze the provided image of a plant leaf.
+    1. Identify the plant if possible (e.g., tomato, rice).
+    2. Identify the disease or pest causing the symptoms shown.
+    3. Explain the cause of the disease.
+    4. Provide a list of actionable steps the farmer should take.
+    5. Suggest at least two affordable, locally available remedies (one organic/natural, one chemical).
+    """
+    PROMPT_TEMPLATE = LANGUAGE_INSTRUCTION
+
     def __init__(self, bridge):
         self.bridge = bridge
+        # Diagnoses keyed by image digest + language, so an identical re-upload skips Gemini
+        self._diagnosis_cache = ResponseCache("CropAgent.diagnose", ttl=3600)
 
     async def diagnose(self, image_path: str, lang: str) -> str:
         """Analyzes a crop image to diagnose diseases."""
-        image_base64 = encode_image_to_base64(image_path)
-        if not image_base64:
+        # Reading, downscaling and encoding happen off the event loop (thread + process pool)
+        encoded = await prepare_image_file(image_path)
+        if not encoded:
             return "Error: Could not read or encode the image file."
+        digest, image_base64 = encoded
+        return await self.diagnose_b64(image_base64, lang, digest=digest)
 
-        prompt = f"""
-        You are an expert agronomist specializing in crop diseases in India.
-        Analyze the provided image of a plant leaf.
-        1. Identify the plant if possible (e.g., tomato, rice).
-        2. Identify the disease or pest causing the symptoms shown.
-        3. Explain the cause of the disease.
-        4. Provide a list of actionable steps the farmer should take.
-        5. Suggest at least two affordable, locally available remedies (one organic/natural, one chemical).
-        
-        IMPORTANT: Provide the entire response in the following language: {lang}.
+    async def diagnose_b64(self, image_base64: str, lang: str, digest: str = None) -> str:
+        """
+        Diagnoses an already base64-encoded crop image. If the image digest is
+        given, a cached diagnosis for the same image and language is reused.
         """
-        return await call_gemini_api(prompt, image_base64=image_base64)
+        cache_key = make_key(digest, lang) if digest else None
+        if cache_key:
+            cached = await self._diagnosis_cache.get(cache_key)
+            if cached is not None:
+                print("⚡ Cache hit for CropAgent.diagnose.")
+                return cached
+
+        prompt = self.PROMPT_TEMPLATE.format_map({"lang": lang})
+        result = await call_gemini_api(prompt, image_base64=image_base64, system_prompt=self.PERSONA)
+        if cache_key and is_model_answer(result):
+            await self._diagnosis_cache.set(cache_key, result)
+        return result
+
+    async def diagnose_stream(self, image_path: str, lang: str):
+        """Like diagnose, but yields the diagnosis in chunks as Gemini generates it."""
+        encoded = await prepare_image_file(image_path)
+        if not encoded:
+            yield "Error: Could not read or encode the image file."
+            return
+        digest, image_base64 = encoded
+
+        cache_key = make_key(digest, lang)
+        cached = await self._diagnosis_cache.get(cache_key)
+        if cached is not None:
+            print("⚡ Cache hit for CropAgent.diagnose.")
+            yield cached
+            return
+
+        prompt = self.PROMPT_TEMPLATE.format_map({"lang": lang})
+        chunks = []
+        async for chunk in stream_gemini_api(prompt, image_base64=image_base64, system_prompt=self.PERSONA):
+            chunks.append(chunk)
+            yield chunk
+        if chunks and not any(isinstance(chunk, ApiError) for chunk in chunks):
+            await self._diagnosis_cache.set(cache_key, "".join(chunks))
+
+# Only these fields of a data.gov.in mandi record matter for the price summary
+MARKET_RECORD_FIELDS = ("arrival_date", "variety", "min_price", "max_price", "modal_price")
+MARKET_RECORDS_LIMIT = 10
+
+def _compact_records(records, limit: int = MARKET_RECORDS_LIMIT) -> str:
+    """
+    Renders mandi records as compact pipe-separated rows (date|variety|min|max|modal),
+    keeping only the last `limit` records. Far fewer tokens than the raw JSON.
+    """
+    rows = ["date|variety|min|max|modal"]
+    for record in records[-limit:]:
+        rows.append("|".join(str(record.get(field, "")) for field in MARKET_RECORD_FIELDS))
+    return "\n".join(rows)
 
 class MarketAgent:
+    PERSONA = """
+    You are a market analyst for Indian farmers. Provide simple, actionable advice.
+    You will be given real-time mandi price data for a commodity and a weather forecast for the market.
+    Provide a summary including min, max, and modal price, and a clear recommendation on whether to sell today.
+    """
+    PROMPT_TEMPLATE = (
+        "Analyze the following real-time market data for '{commodity}' in '{market}'.\n"
+        "Also consider this weather forecast: {weather_report}\n\n"
+        "Recent prices in Rs/quintal (pipe-separated, one row per record):\n{records}\n\n" + LANGUAGE_INSTRUCTION
+    )
+
     def __init__(self, bridge):
         self.bridge = bridge
 
@@ -37,49 +112,63 @@ class MarketAgent:
         if not commodity or not market:
             return "To get market prices, please tell me the crop and the market name (mandi)."
         
-        market_data = get_market_data_from_gov_api(commodity, market)
+        # The mandi prices and the weather are independent, so fetch them concurrently
+        market_data, weather_data = await asyncio.gather(
+            get_market_data_from_gov_api(commodity, market),
+            get_weather_from_api(market)
+        )
+        # The WeatherAgent only formats the payload fetched above, no second lookup
+        weather_report = self.bridge.request(Msg(
+            target="WeatherAgent",
+            task="format_forecast",
+            data={"city": market, "weather_data": weather_data}
+        ))
 
         if "error" in market_data:
             return f"Sorry, I could not fetch market data. Reason: {market_data['error']}"
 
-        weather_report = self.bridge.request(
-            target_agent_name="WeatherAgent",
-            task="get_simple_forecast",
-            data={"city": market}
-        )
-
-        prompt = f"""
-        You are a market analyst for Indian farmers. Provide simple, actionable advice.
-        Analyze the following real-time market data for '{commodity}' in '{market}'.
-        Also consider this weather forecast: {weather_report}
-
-        Market Data:
-        {json.dumps(market_data['records'], indent=2)}
-
-        Provide a summary including min, max, and modal price, and a clear recommendation on whether to sell today.
-        IMPORTANT: Provide the entire response in the following language: {lang}.
-        """
+        prompt = self.PROMPT_TEMPLATE.format_map({
+            "commodity": commodity,
+            "market": market,
+            "weather_report": weather_report,
+            "records": _compact_records(market_data.get('records', [])),
+            "lang": lang
+        })
         
-        return await call_gemini_api(prompt)
+        return await call_gemini_api(prompt, system_prompt=self.PERSONA)
 
 class SchemeAgent:
+    PERSONA = """
+    You are an expert on Indian government agricultural schemes.
+    Identify the schemes most relevant to the farmer's request. For each, explain the benefit, eligibility, and how to apply.
+    """
+    PROMPT_TEMPLATE = "A farmer has asked for help with: '{query}'.\n" + LANGUAGE_INSTRUCTION
+
     def __init__(self, bridge):
         self.bridge = bridge
 
+    @cached_llm(ttl=3600, cache_if=is_model_answer)
     async def find_schemes(self, query: str, lang: str) -> str:
         """Finds and explains government schemes."""
         if not query:
             return "Please tell me what kind of scheme or subsidy you are looking for."
             
-        prompt = f"""
-        You are an expert on Indian government agricultural schemes.
-        A farmer has asked for help with: '{query}'.
-        Identify the most relevant schemes. For each, explain the benefit, eligibility, and how to apply.
-        IMPORTANT: Provide the entire response in the following language: {lang}.
-        """
-        return await call_gemini_api(prompt)
+        prompt = self.PROMPT_TEMPLATE.format_map({"query": query, "lang": lang})
+        return await call_gemini_api(prompt, system_prompt=self.PERSONA)
 
 class WeatherAgent:
+    PERSONA = """
+    You are a weather reporter for an Indian farmer.
+    Take the weather data you are given and present it as a simple, clear report.
+
+    Example format:
+    Weather for [City]:
+    - Condition: [Condition]
+    - Temperature: [Temperature]°C
+    - Humidity: [Humidity]%
+    """
+    PROMPT_TEMPLATE = "Weather Data:\n{report}\n\n" + LANGUAGE_INSTRUCTION
+
     def __init__(self, bridge):
         self.bridge = bridge
 
@@ -89,7 +178,7 @@ class WeatherAgent:
         if not city:
             return "Please tell me the city or town for the weather forecast."
 
-        weather_data = get_weather_from_api(city)
+        weather_data = await get_weather_from_api(city)
         if "error" in weather_data:
              return f"Could not get weather for '{city}'. Reason: {weather_data['error']}"
 
@@ -105,64 +194,64 @@ class WeatherAgent:
         }
 
         # Create a prompt for the LLM to format and translate the data
-        prompt = f"""
-        You are a weather reporter for an Indian farmer.
-        Take the following weather data and present it as a simple, clear report.
+        prompt = self.PROMPT_TEMPLATE.format_map({"report": orjson.dumps(report_data).decode(), "lang": lang})
+        return await call_gemini_api(prompt, system_prompt=self.PERSONA)
 
-        Weather Data:
-        {json.dumps(report_data)}
+    @staticmethod
+    def _format_forecast(city: str, weather_data: dict) -> str:
+        """Turns a parsed OpenWeather payload into a one-line forecast."""
+        if "error" in weather_data:
+            return "Weather data unavailable."
+        desc = weather_data['weather'][0]['description']
+        temp = weather_data['main']['temp']
+        return f"Forecast for {city}: {desc.title()} with temperatures around {temp}°C."
 
-        Example format:
-        Weather for [City]:
-        - Condition: [Condition]
-        - Temperature: [Temperature]°C
-        - Humidity: [Humidity]%
+    async def handle_get_simple_forecast(self, city: str = None) -> str:
+        """Bridge task 'get_simple_forecast': fetches the weather and returns a one-line forecast."""
+        if not city: return "No city provided."
+        return self._format_forecast(city, await get_weather_from_api(city))
 
-        IMPORTANT: Provide the entire response in the following language: {lang}.
-        """
-        return await call_gemini_api(prompt)
-
-    def handle_request(self, task: str, data: dict) -> str:
-        """Handles requests from other agents."""
-        if task == "get_simple_forecast":
-            city = data.get("city")
-            if not city: return "No city provided."
-            weather_data = get_weather_from_api(city)
-            if "error" in weather_data:
-                return "Weather data unavailable."
-            desc = weather_data['weather'][0]['description']
-            temp = weather_data['main']['temp']
-            return f"Forecast for {city}: {desc.title()} with temperatures around {temp}°C."
-        return "Unknown task."
+    def handle_format_forecast(self, city: str, weather_data: dict) -> str:
+        """Bridge task 'format_forecast': a one-line forecast from an already-fetched payload."""
+        return self._format_forecast(city, weather_data)
 
 class OrganicAgent:
+    PERSONA = """
+    You are an expert in organic farming in India.
+    Provide a practical, step-by-step guide on the topic the farmer asks about.
+    """
+    PROMPT_TEMPLATE = "A farmer wants to know about '{topic}'.\n" + LANGUAGE_INSTRUCTION
+
     def __init__(self, bridge):
         self.bridge = bridge
 
+    @cached_llm(ttl=3600, cache_if=is_model_answer)
     async def get_tips(self, topic: str, lang: str) -> str:
         """Provides tips on organic farming."""
         if not topic:
             return "Please tell me what organic farming topic you are interested in."
 
-        prompt = f"""
-        You are an expert in organic farming in India. A farmer wants to know about '{topic}'.
-        Provide a practical, step-by-step guide.
-        IMPORTANT: Provide the entire response in the following language: {lang}.
-        """
-        return await call_gemini_api(prompt)
+        prompt = self.PROMPT_TEMPLATE.format_map({"topic": topic, "lang": lang})
+        return await call_gemini_api(prompt, system_prompt=self.PERSONA)
 
 class SoilAgent:
+    PERSONA = """
+    You are an expert soil scientist for Indian agriculture.
+    Provide an analysis of the soil the farmer describes: Likely soil type, characteristics, suitable crops, and improvement steps.
+    """
+    PROMPT_TEMPLATE = (
+        'A farmer has described their soil: "{query}".\n'
+        "IMPORTANT: Provide the entire response in a clear, easy-to-understand format in the following language: {lang}."
+    )
+
     def __init__(self, bridge):
         self.bridge = bridge
 
+    @cached_llm(ttl=3600, cache_if=is_model_answer)
     async def analyze_soil(self, query: str, lang: str) -> str:
         """Analyzes a farmer's description of their soil."""
         if not query:
             return "Please describe your soil. For example, 'My soil is red and does not hold water well'."
 
-        prompt = f"""
-        You are an expert soil scientist for Indian agriculture. A farmer has described their soil: "{query}".
-        Provide an analysis: Likely soil type, characteristics, suitable crops, and improvement steps.
-        IMPORTANT: Provide the entire response in a clear, easy-to-understand format in the following language: {lang}.
-        """
-        return await call_gemini_api(prompt)
+        prompt = self.PROMPT_TEMPLATE.format_map({"query": query, "lang": lang})
+        return await call_gemini_api(prompt, system_prompt=self.PERSONA)
@@ -2,59 +2,197 @@
 # This file centralizes all the logic for making external API calls.
 # This version uses the fast and efficient gemini-2.0-flash model.
 
+import io
 import os
-import requests
+import asyncio
+import hashlib
+import threading
+import httpx
 import base64
-import json
+import orjson
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from cachetools import LRUCache
+from PIL import Image, ImageOps
+from cache import async_ttl_cache
 
-async def call_gemini_api(prompt, image_base64=None):
+GEMINI_BASE_URL = "https://generativelanguage.googleapis.com/v1beta"
+GEMINI_MODEL = "gemini-2.0-flash"
+
+# Structured-output schema for the agent routers (web and voice). Gemini is forced to
+# answer with exactly this JSON shape, so no markdown fences or free text come back.
+ROUTER_RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "agent": {
+            "type": "STRING",
+            "format": "enum",
+            "enum": ["WeatherAgent", "MarketAgent", "SchemeAgent", "SoilAgent",
+                     "OrganicAgent", "CropAgent", "General", "Unclear"]
+        },
+        "parameters": {
+            "type": "OBJECT",
+            "properties": {
+                "city": {"type": "STRING"},
+                "commodity": {"type": "STRING"},
+                "market": {"type": "STRING"},
+                "query": {"type": "STRING"},
+                "topic": {"type": "STRING"},
+                "response": {"type": "STRING"}
+            }
+        }
+    },
+    "required": ["agent", "parameters"]
+}
+
+# --- Shared HTTP client ---
+# One pooled client is reused for every outbound call so keep-alive connections
+# (and their TCP/TLS handshakes) are shared between requests. httpx clients are
+# tied to the event loop they were first used on, so a new one is created if the
+# running loop changes (e.g. across separate asyncio.run calls).
+_client = None
+_client_loop = None
+
+def get_client() -> httpx.AsyncClient:
+    """Returns the shared async HTTP client for the running event loop."""
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client.is_closed or _client_loop is not loop:
+        _client = httpx.AsyncClient(http2=True, timeout=30, limits=httpx.Limits(max_keepalive_connections=20))
+        _client_loop = loop
+    return _client
+
+async def close_client():
+    """Closes the shared HTTP client, if it belongs to the running event loop."""
+    global _client, _client_loop
+    if _client is not None and _client_loop is asyncio.get_running_loop():
+        await _client.aclose()
+    _client = None
+    _client_loop = None
+
+class ApiError(str):
+    """
+    The message returned by call_gemini_api when no model answer was produced.
+    It behaves like a normal string for display, but lets callers (e.g. caches)
+    tell a failure apart from a real response.
+    """
+
+def is_model_answer(result) -> bool:
+    """True if result is an actual model response rather than an ApiError."""
+    return isinstance(result, str) and not isinstance(result, ApiError)
+
+def _build_gemini_payload(prompt, image_base64, system_prompt, response_schema=None, temperature=None):
+    """Builds a generateContent request body."""
+    parts = [{"text": prompt}]
+    if image_base64:
+        # Add the image part if it exists
+        parts.append({"inlineData": {"mimeType": "image/jpeg", "data": image_base64}})
+
+    payload = {"contents": [{"role": "user", "parts": parts}]}
+
+    if system_prompt:
+        payload["systemInstruction"] = {"parts": [{"text": system_prompt}]}
+
+    generation_config = {}
+    if response_schema:
+        generation_config["responseMimeType"] = "application/json"
+        generation_config["responseSchema"] = response_schema
+    if temperature is not None:
+        generation_config["temperature"] = temperature
+    if generation_config:
+        payload["generationConfig"] = generation_config
+    return payload
+
+async def call_gemini_api(prompt, image_base64=None, system_prompt=None, response_schema=None, temperature=None):
     """
     Calls the Gemini API for either text or vision models.
     This version uses the fast gemini-2.0-flash model.
+    If a system_prompt is given it is sent as the system instruction.
+    If a response_schema is given, the model must answer with JSON matching it.
     """
     api_key = os.getenv("GOOGLE_API_KEY")
     if not api_key:
         print("🔴 ERROR: GOOGLE_API_KEY not found in .env file.")
-        return "Error: GOOGLE_API_KEY not found in .env file. Please get a key from Google AI Studio."
+        return ApiError("Error: GOOGLE_API_KEY not found in .env file. Please get a key from Google AI Studio.")
 
     headers = {'Content-Type': 'application/json'}
-    parts = [{"text": prompt}]
-    
-    # --- SOLUTION: Switch to the simple, faster model ---
     # This model handles both text and images with a single endpoint.
-    api_url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={api_key}"
-    if image_base64:
-        # Add the image part if it exists
-        parts.append({"inlineData": {"mimeType": "image/jpeg", "data": image_base64}})
-    # --- END OF SOLUTION ---
-
-    payload = {"contents": [{"role": "user", "parts": parts}]}
+    api_url = f"{GEMINI_BASE_URL}/models/{GEMINI_MODEL}:generateContent?key={api_key}"
+    payload = _build_gemini_payload(prompt, image_base64, system_prompt, response_schema, temperature)
 
     try:
-        print(f"➡️ Sending request to Gemini API (flash model)...")
-        response = requests.post(api_url, headers=headers, json=payload)
+        print("➡️ Sending request to Gemini API (flash model)...")
+        response = await get_client().post(api_url, headers=headers, content=orjson.dumps(payload))
         
         response.raise_for_status() 
         
-        result = response.json()
+        result = orjson.loads(response.content)
 
         if result.get('candidates'):
             print("✅ Successfully received response from Gemini API.")
             return result['candidates'][0]['content']['parts'][0]['text']
         else:
             print(f"🟡 WARNING: Gemini API responded but with no candidates. Full response: {response.text}")
-            return "The AI model responded, but the content may have been blocked for safety reasons."
+            return ApiError("The AI model responded, but the content may have been blocked for safety reasons.")
             
-    except requests.exceptions.RequestException as e:
-        if e.response is not None:
-            print(f"🔴 Server Response: {e.response.text}")
-        return f"API Request Error: Could not connect to Google AI. Please check your API key and ensure the API is enabled in your Google Cloud project."
+    except httpx.HTTPStatusError as e:
+        print(f"🔴 Server Response: {e.response.text}")
+        return ApiError("API Request Error: Could not connect to Google AI. Please check your API key and ensure the API is enabled in your Google Cloud project.")
+    except httpx.RequestError as e:
+        print(f"🔴 Network Error: {e}")
+        return ApiError("API Request Error: Could not connect to Google AI. Please check your API key and ensure the API is enabled in your Google Cloud project.")
     except Exception as e:
         print(f"🔴 ERROR: An unexpected error occurred: {e}")
-        return f"An unexpected error occurred during the API call."
+        return ApiError("An unexpected error occurred during the API call.")
+
+async def stream_gemini_api(prompt, image_base64=None, system_prompt=None):
+    """
+    Streams a Gemini response (server-sent events), yielding text chunks as soon
+    as the model produces them. On failure a single ApiError message is yielded.
+    """
+    api_key = os.getenv("GOOGLE_API_KEY")
+    if not api_key:
+        print("🔴 ERROR: GOOGLE_API_KEY not found in .env file.")
+        yield ApiError("Error: GOOGLE_API_KEY not found in .env file. Please get a key from Google AI Studio.")
+        return
+
+    headers = {'Content-Type': 'application/json'}
+    api_url = f"{GEMINI_BASE_URL}/models/{GEMINI_MODEL}:streamGenerateContent?alt=sse&key={api_key}"
+    payload = _build_gemini_payload(prompt, image_base64, system_prompt)
+
+    try:
+        print("➡️ Streaming request to Gemini API (flash model)...")
+        async with get_client().stream("POST", api_url, headers=headers, content=orjson.dumps(payload)) as response:
+            if response.is_error:
+                await response.aread()
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                # Each SSE event is a 'data: {...}' line holding a partial GenerateContentResponse
+                if not line.startswith("data:"):
+                    continue
+                chunk = orjson.loads(line[len("data:"):])
+                for candidate in chunk.get('candidates', [])[:1]:
+                    for part in candidate.get('content', {}).get('parts', []):
+                        if part.get('text'):
+                            yield part['text']
+        print("✅ Finished streaming response from Gemini API.")
+
+    except httpx.HTTPStatusError as e:
+        print(f"🔴 Server Response: {e.response.text}")
+        yield ApiError("API Request Error: Could not connect to Google AI. Please check your API key and ensure the API is enabled in your Google Cloud project.")
+    except httpx.RequestError as e:
+        print(f"🔴 Network Error: {e}")
+        yield ApiError("API Request Error: Could not connect to Google AI. Please check your API key and ensure the API is enabled in your Google Cloud project.")
+    except ValueError as e:
+        print(f"🔴 ERROR: Could not parse streamed response: {e}")
+        yield ApiError("An unexpected error occurred during the API call.")
 
 # The rest of the functions remain the same
-def get_market_data_from_gov_api(commodity: str, market: str) -> dict:
+# Mandi prices change at most a few times a day and weather every few minutes, so
+# both lookups are cached by normalized place/commodity. Error results are not cached.
+@async_ttl_cache(ttl=21600, key=lambda commodity, market: (commodity.strip().lower(), market.strip().lower()),
+                 cache_if=lambda data: "error" not in data)
+async def get_market_data_from_gov_api(commodity: str, market: str) -> dict:
     """Fetches real-time market price data from India's data.gov.in API."""
     api_key = os.getenv("DATA_GOV_IN_API_KEY") 
     if not api_key:
@@ -65,13 +203,14 @@ def get_market_data_from_gov_api(commodity: str, market: str) -> dict:
         "filters[commodity]": commodity, "filters[market]": market
     }
     try:
-        response = requests.get(base_url, params=params)
+        response = await get_client().get(base_url, params=params)
         response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
+        return orjson.loads(response.content)
+    except (httpx.HTTPError, orjson.JSONDecodeError) as e:
         return {"error": str(e)}
 
-def get_weather_from_api(city: str) -> dict:
+@async_ttl_cache(ttl=600, key=lambda city: city.strip().lower(), cache_if=lambda data: "error" not in data)
+async def get_weather_from_api(city: str) -> dict:
     """Fetches weather data from OpenWeatherMap API."""
     api_key = os.getenv("OPENWEATHER_API_KEY")
     if not api_key:
@@ -79,16 +218,106 @@ def get_weather_from_api(city: str) -> dict:
     base_url = "http://api.openweathermap.org/data/2.5/weather"
     params = {"q": city, "appid": api_key, "units": "metric"}
     try:
-        response = requests.get(base_url, params=params)
+        response = await get_client().get(base_url, params=params)
         response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
+        return orjson.loads(response.content)
+    except (httpx.HTTPError, orjson.JSONDecodeError) as e:
         return {"error": str(e)}
 
-def encode_image_to_base64(image_path):
-    """Encodes an image file to a base64 string."""
+# --- Image preparation ---
+# Photos are downscaled, stripped of EXIF metadata, re-encoded as JPEG and base64-encoded
+# in a process pool, so this CPU-bound work runs on all cores instead of holding the
+# GIL in the server process. Farmers often retry with the same photo, so prepared
+# images are also kept in a small LRU keyed by a fast blake2b digest of the raw bytes.
+IMAGE_MAX_SIZE = (1024, 1024)
+IMAGE_JPEG_QUALITY = 85
+
+_image_pool = None
+_image_cache = LRUCache(maxsize=32)
+_image_cache_lock = threading.Lock()
+
+def _get_image_pool() -> ProcessPoolExecutor:
+    """Returns the shared image-preparation process pool, starting it on first use."""
+    global _image_pool
+    if _image_pool is None:
+        _image_pool = ProcessPoolExecutor(max_workers=os.cpu_count())
+    return _image_pool
+
+def shutdown_image_pool():
+    """Stops the image-preparation worker processes, if they were started."""
+    global _image_pool
+    if _image_pool is not None:
+        _image_pool.shutdown(wait=False, cancel_futures=True)
+        _image_pool = None
+
+def _reset_image_pool(broken_pool):
+    """Drops a broken pool so the next image starts a fresh one."""
+    global _image_pool
+    if _image_pool is broken_pool:
+        _image_pool = None
+        broken_pool.shutdown(wait=False, cancel_futures=True)
+
+def image_digest(data) -> str:
+    """Returns a short blake2b hex digest of raw image bytes."""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def _prepare_image(data: bytes) -> str:
+    """
+    Runs in a worker process. Returns the image as a base64 JPEG of at most
+    IMAGE_MAX_SIZE pixels without metadata. Files Pillow cannot decode (or refuses
+    to, such as decompression bombs) are sent as-is.
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            # Let the JPEG decoder downscale while decoding, so huge photos never
+            # need full-resolution memory
+            image.draft("RGB", IMAGE_MAX_SIZE)
+            # Apply the EXIF orientation to the pixels before the metadata is dropped
+            image = ImageOps.exif_transpose(image).convert("RGB")
+            image.thumbnail(IMAGE_MAX_SIZE)
+            buffer = io.BytesIO()
+            image.save(buffer, format="JPEG", quality=IMAGE_JPEG_QUALITY)
+            data = buffer.getvalue()
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        print(f"🟡 WARNING: Could not downscale image, sending it unchanged. Reason: {e}")
+    return base64.b64encode(data).decode('utf-8')
+
+async def prepare_image_bytes(data: bytes):
+    """Returns (digest, base64 JPEG) for raw image bytes, or None if there are none."""
+    if not data:
+        return None
+    digest = image_digest(data)
+    with _image_cache_lock:
+        image_base64 = _image_cache.get(digest)
+    if image_base64 is None:
+        loop = asyncio.get_running_loop()
+        pool = _get_image_pool()
+        try:
+            image_base64 = await loop.run_in_executor(pool, _prepare_image, data)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed while decoding a huge image). Restart the pool
+            # on the next photo and send this one unchanged rather than failing.
+            print("🔴 ERROR: Image worker pool crashed, restarting it. Sending this image unchanged.")
+            _reset_image_pool(pool)
+            return digest, base64.b64encode(data).decode('utf-8')
+        with _image_cache_lock:
+            _image_cache[digest] = image_base64
+    return digest, image_base64
+
+def _read_file(image_path):
     try:
         with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
+            return image_file.read()
     except FileNotFoundError:
         return None
+
+async def prepare_image_file(image_path):
+    """Returns (digest, base64 JPEG) for an image file, or None if it cannot be read."""
+    return await prepare_image_bytes(await asyncio.to_thread(_read_file, image_path))
+
+async def prepare_image_stream(fp):
+    """
+    Returns (digest, base64 JPEG) for an image read from a file-like object
+    (e.g. an uploaded file's stream), or None if it is empty. Nothing touches the disk.
+    """
+    return await prepare_image_bytes(await asyncio.to_thread(fp.read))
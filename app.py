@@ -1,11 +1,16 @@
 # app.py
 # This file creates a web server to run Project Kisan as a local web application.
+# It is an ASGI app (Quart) served by uvicorn, so the awaits inside the agent
+# pipeline let one worker handle many requests concurrently.
 
 import os
+import re
 import sys
-import json
+import orjson
 import asyncio
-from flask import Flask, render_template, request, jsonify
+import uvicorn
+from quart import Quart, render_template, request, jsonify
+from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
 
 # Add the project's root directory to Python's path if it's not already there
@@ -16,14 +21,23 @@ if os.path.dirname(os.path.abspath(__file__)) not in sys.path:
 # Import your existing agents and bridge
 from bridge import AgentBridge
 from all_agents import CropAgent, MarketAgent, SchemeAgent, WeatherAgent, OrganicAgent, SoilAgent
-from api_helpers import call_gemini_api
+from api_helpers import ROUTER_RESPONSE_SCHEMA, call_gemini_api, close_client, prepare_image_stream, shutdown_image_pool
+from cache import ResponseCache, make_key
+from router_rules import quick_route
 
 # --- Initialization ---
 load_dotenv()
 
-# Initialize the Flask app
-app = Flask(__name__)
+# Initialize the Quart app (Flask-compatible API, but natively async)
+app = Quart(__name__)
 app.config['UPLOAD_FOLDER'] = 'uploads'
+# Uploaded photos are diagnosed straight from memory; set KEEP_UPLOADS=1 to also
+# keep a copy in the upload folder.
+app.config['KEEP_UPLOADS'] = os.getenv("KEEP_UPLOADS") == "1"
+# Request body limits. Quart defaults to 16 MiB and 60 seconds; allow full-resolution
+# phone photos (MAX_UPLOAD_MB, default 32) and slow rural connections (5 minutes).
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv("MAX_UPLOAD_MB", "32")) * 1024 * 1024
+app.config['BODY_TIMEOUT'] = 300
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
 
@@ -44,99 +58,214 @@ for name, agent in agents.items():
 print("\n✅ Kisan Web App Server is ready and agents are initialized.")
 
 # --- AI Router ---
+# Router decisions for identical (normalized) queries are reused for an hour.
+router_cache = ResponseCache("router", ttl=3600)
+
+# The static routing instructions are sent as the system prompt;
+# only the user's query changes from call to call.
+ROUTER_PROMPT = """
+You are an intelligent router for an agricultural AI assistant called Kisan Mitra. Your job is to analyze a farmer's query and determine which expert agent should handle it. You must also extract any necessary information (parameters) from the query.
+
+Here are the available agents and the keywords they respond to:
+- "WeatherAgent": For questions about weather, forecast, rain, temperature, humidity.
+- "MarketAgent": For questions about market prices, mandi rates, crop prices.
+- "SchemeAgent": For questions about government schemes, subsidies, PM-KISAN, loans.
+- "SoilAgent": For questions describing soil type (e.g., "my soil is red and sandy", "black and sticky").
+- "OrganicAgent": For questions about organic farming, compost, natural pesticides.
+- "CropAgent": For questions about crop diseases, pests, sick plants (usually triggered by a photo).
+- "General": For polite closings like "thank you", "ok", "bye".
+
+Your response must be a single, clean JSON object with two keys: "agent" and "parameters".
+
+Examples:
+- Query: "weather in hyderabad?" -> {"agent": "WeatherAgent", "parameters": {"city": "Hyderabad"}}
+- Query: "What is the price of potato in Agra?" -> {"agent": "MarketAgent", "parameters": {"commodity": "Potato", "market": "Agra"}}
+- Query: "Tell me about the PM-KISAN scheme" -> {"agent": "SchemeAgent", "parameters": {"query": "PM-KISAN scheme"}}
+- Query: "My soil is black and sticky" -> {"agent": "SoilAgent", "parameters": {"query": "My soil is black and sticky"}}
+- Query: "Hyderabad" -> {"agent": "WeatherAgent", "parameters": {"city": "Hyderabad"}}
+- Query: "how to make compost" -> {"agent": "OrganicAgent", "parameters": {"topic": "how to make compost"}}
+- Query: "thank you" -> {"agent": "General", "parameters": {"response": "You're welcome! Let me know if you have more questions."}}
+"""
+ROUTER_QUERY_TEMPLATE = 'The user\'s query is: "{query}"'
+
+# Looser keyword hints. They are not decisive enough to skip the LLM router, but good
+# enough to start the likely agent speculatively while the router is still thinking.
+ROUTER_HINTS = [
+    (re.compile(r"\b(?:loans?|yojana|insurance|kcc|credit\s+card|pension|government)\b", re.I),
+     "SchemeAgent", lambda m, q: {"query": q.strip()}),
+    (re.compile(r"\b(?:soil|clay|sandy|loamy?)\b", re.I),
+     "SoilAgent", lambda m, q: {"query": q.strip()}),
+    (re.compile(r"\b(?:manure|neem|jeevamrut\w*|bio[\s-]?fertili[sz]ers?|natural\s+pesticides?)\b", re.I),
+     "OrganicAgent", lambda m, q: {"topic": q.strip()}),
+]
+
+def guess_route(query: str):
+    """Returns the likely routing from ROUTER_HINTS, or None if there is no hint."""
+    for pattern, agent_name, extract in ROUTER_HINTS:
+        match = pattern.search(query)
+        if match:
+            return {"agent": agent_name, "parameters": extract(match, query)}
+    return None
+
+async def known_route(query: str, lang: str):
+    """Returns the routing from the rules or the router cache, or None if the LLM must decide."""
+    routing_info = quick_route(query) if query else None
+    if routing_info is not None:
+        print(f"🧠 Rule Router Output: {orjson.dumps(routing_info).decode()}")
+        return routing_info
+
+    cached = await router_cache.get(make_key(query, lang))
+    if cached is not None:
+        print(f"🧠 AI Router (cached): {orjson.dumps(cached).decode()}")
+    return cached
+
 async def route_query_to_agent(query: str, lang: str):
     """Uses an LLM to analyze the user's query and determine the correct agent."""
-    
+    routing_info = await known_route(query, lang)
+    if routing_info is not None:
+        return routing_info
+    return await ask_llm_router(query, lang)
+
+async def ask_llm_router(query: str, lang: str):
+    """Asks Gemini to route the query, caching any decisive answer."""
+    cache_key = make_key(query, lang)
     print("🧠 AI Router: Analyzing query...")
     
-    # --- SOLUTION: Added a smarter prompt for the router ---
-    prompt = f"""
-    You are an intelligent router for an agricultural AI assistant called Kisan Mitra. Your job is to analyze a farmer's query and determine which expert agent should handle it. You must also extract any necessary information (parameters) from the query.
-
-    The user's query is: "{query}"
-
-    Here are the available agents and the keywords they respond to:
-    - "WeatherAgent": For questions about weather, forecast, rain, temperature, humidity.
-    - "MarketAgent": For questions about market prices, mandi rates, crop prices.
-    - "SchemeAgent": For questions about government schemes, subsidies, PM-KISAN, loans.
-    - "SoilAgent": For questions describing soil type (e.g., "my soil is red and sandy", "black and sticky").
-    - "OrganicAgent": For questions about organic farming, compost, natural pesticides.
-    - "CropAgent": For questions about crop diseases, pests, sick plants (usually triggered by a photo).
-    - "General": For polite closings like "thank you", "ok", "bye".
-
-    Your response must be a single, clean JSON object with two keys: "agent" and "parameters".
-
-    Examples:
-    - Query: "weather in hyderabad?" -> {{"agent": "WeatherAgent", "parameters": {{"city": "Hyderabad"}}}}
-    - Query: "What is the price of potato in Agra?" -> {{"agent": "MarketAgent", "parameters": {{"commodity": "Potato", "market": "Agra"}}}}
-    - Query: "Tell me about the PM-KISAN scheme" -> {{"agent": "SchemeAgent", "parameters": {{"query": "PM-KISAN scheme"}}}}
-    - Query: "My soil is black and sticky" -> {{"agent": "SoilAgent", "parameters": {{"query": "My soil is black and sticky"}}}}
-    - Query: "Hyderabad" -> {{"agent": "WeatherAgent", "parameters": {{"city": "Hyderabad"}}}}
-    - Query: "how to make compost" -> {{"agent": "OrganicAgent", "parameters": {{"topic": "how to make compost"}}}}
-    - Query: "thank you" -> {{"agent": "General", "parameters": {{"response": "You're welcome! Let me know if you have more questions."}}}}
-    """
+    prompt = ROUTER_QUERY_TEMPLATE.format_map({"query": query})
     
-    response_text = await call_gemini_api(prompt)
+    # JSON mode with temperature 0: a deterministic, schema-valid answer that is safe to cache
+    response_text = await call_gemini_api(prompt, system_prompt=ROUTER_PROMPT,
+                                          response_schema=ROUTER_RESPONSE_SCHEMA, temperature=0)
     try:
-        # Clean the response to make sure it's valid JSON
-        json_str = response_text.strip().replace("```json", "").replace("```", "")
-        parsed_json = json.loads(json_str)
-        print(f"🧠 AI Router Output: {json.dumps(parsed_json)}")
+        parsed_json = orjson.loads(response_text)
+        print(f"🧠 AI Router Output: {orjson.dumps(parsed_json).decode()}")
+        # "Unclear" is a non-answer; let the query be routed afresh next time.
+        if parsed_json.get("agent") != "Unclear":
+            await router_cache.set(cache_key, parsed_json)
         return parsed_json
-    except (json.JSONDecodeError, AttributeError) as e:
+    except orjson.JSONDecodeError as e:
         print(f"🔴 AI Router failed to parse JSON: {e}")
         return {"agent": "Unclear", "parameters": {}}
 
+# --- Agent Dispatch ---
+async def dispatch(routing_info: dict, language: str) -> str:
+    """Runs the agent chosen by the router and returns its answer."""
+    agent_name = routing_info.get("agent")
+    params = routing_info.get("parameters", {})
+    
+    result = "I'm sorry, I'm not sure how to help with that. Could you please rephrase your question?"
+
+    if agent_name == "General":
+        result = params.get("response", "You're welcome!")
+    elif agent_name in agents:
+        target_agent = agents[agent_name]
+        try:
+            if agent_name == "MarketAgent":
+                result = await target_agent.get_market_price(params.get("commodity"), params.get("market"), language)
+            elif agent_name == "SchemeAgent":
+                result = await target_agent.find_schemes(params.get("query"), language)
+            elif agent_name == "WeatherAgent":
+                result = await target_agent.get_weather(params.get("city"), language)
+            elif agent_name == "OrganicAgent":
+                result = await target_agent.get_tips(params.get("topic"), language)
+            elif agent_name == "SoilAgent":
+                result = await target_agent.analyze_soil(params.get("query"), language)
+        except Exception as e:
+            print(f"🔴 ERROR processing request: {e}")
+            result = "Sorry, something went wrong."
+    return result
+
+async def answer_query(query: str, language: str) -> str:
+    """
+    Routes a text query and runs the chosen agent. If the query carries a keyword
+    hint, the hinted agent is started speculatively alongside the LLM router; its
+    answer is used if the router agrees, and cancelled otherwise.
+    """
+    routing_info = await known_route(query, language)
+    if routing_info is not None:
+        # Already decided by the rules or the cache; nothing to speculate on
+        return await dispatch(routing_info, language)
+
+    guess = guess_route(query) if query else None
+    if guess is None:
+        return await dispatch(await ask_llm_router(query, language), language)
+
+    speculative = asyncio.create_task(dispatch(guess, language))
+    try:
+        routing_info = await ask_llm_router(query, language)
+    except BaseException:
+        # The request failed or was cancelled (e.g. client disconnect); don't leave
+        # the speculative agent call running in the background.
+        speculative.cancel()
+        raise
+    if routing_info.get("agent") == guess["agent"]:
+        print(f"⚡ Speculative {guess['agent']} call confirmed by the router.")
+        return await speculative
+
+    print(f"↩️ Router chose {routing_info.get('agent')}, cancelling speculative {guess['agent']} call.")
+    speculative.cancel()
+    return await dispatch(routing_info, language)
+
+@app.after_serving
+async def release_shared_resources():
+    """Closes the shared HTTP client and image worker pool when the server shuts down."""
+    await close_client()
+    shutdown_image_pool()
+
+# --- Error Handlers ---
+# The chat page always reads the reply as JSON, so request errors answer in JSON too.
+@app.errorhandler(413)
+async def request_too_large(error):
+    limit_mb = app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)
+    return jsonify({'response': f"That file is too large. Please upload a photo smaller than {limit_mb} MB."}), 413
+
+@app.errorhandler(408)
+async def request_timed_out(error):
+    return jsonify({'response': "The upload took too long. Please check your connection and try again."}), 408
+
 # --- Web Routes ---
 @app.route('/')
-def index():
+async def index():
     """Renders the main chat interface."""
-    return render_template('index.html')
+    return await render_template('index.html')
 
 @app.route('/ask', methods=['POST'])
 async def ask():
     """Handles incoming requests from the user (text or photo)."""
     
-    if 'photo' in request.files:
-        photo = request.files['photo']
-        language = request.form.get('language', 'English')
-        filename = os.path.join(app.config['UPLOAD_FOLDER'], photo.filename)
-        photo.save(filename)
+    files = await request.files
+    if 'photo' in files:
+        photo = files['photo']
+        form = await request.form
+        language = form.get('language', 'English')
+        encoded = await prepare_image_stream(photo.stream)
         
         target_agent = agents["CropAgent"]
-        result = await target_agent.diagnose(filename, language)
+        if not encoded:
+            result = "Error: Could not read or encode the image file."
+        elif app.config['KEEP_UPLOADS']:
+            digest, image_base64 = encoded
+            filename = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(photo.filename) or f"{digest}.jpg")
+            photo.stream.seek(0)
+            result, _ = await asyncio.gather(
+                target_agent.diagnose_b64(image_base64, language, digest=digest),
+                photo.save(filename)
+            )
+        else:
+            digest, image_base64 = encoded
+            result = await target_agent.diagnose_b64(image_base64, language, digest=digest)
 
     else:
-        data = request.json
+        data = await request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'response': "Please send your question as JSON, or upload a photo."}), 400
         query = data.get('query')
         language = data.get('language', 'English')
-        
-        routing_info = await route_query_to_agent(query, language)
-        agent_name = routing_info.get("agent")
-        params = routing_info.get("parameters", {})
-        
-        result = "I'm sorry, I'm not sure how to help with that. Could you please rephrase your question?"
-
-        if agent_name == "General":
-            result = params.get("response", "You're welcome!")
-        elif agent_name in agents:
-            target_agent = agents[agent_name]
-            try:
-                if agent_name == "MarketAgent":
-                    result = await target_agent.get_market_price(params.get("commodity"), params.get("market"), language)
-                elif agent_name == "SchemeAgent":
-                    result = await target_agent.find_schemes(params.get("query"), language)
-                elif agent_name == "WeatherAgent":
-                    result = await target_agent.get_weather(params.get("city"), language)
-                elif agent_name == "OrganicAgent":
-                    result = await target_agent.get_tips(params.get("topic"), language)
-                elif agent_name == "SoilAgent":
-                    result = await target_agent.analyze_soil(params.get("query"), language)
-            except Exception as e:
-                print(f"🔴 ERROR processing request: {e}")
-                result = "Sorry, something went wrong."
+
+        result = await answer_query(query, language)
 
     return jsonify({'response': result})
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    # Each worker is a separate process with its own event loop (uvloop when installed)
+    uvicorn.run("app:app", host='0.0.0.0', port=5000, workers=int(os.getenv("WEB_CONCURRENCY", "4")))
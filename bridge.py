@@ -2,35 +2,75 @@
 # This file defines the AgentBridge class, which facilitates communication
 # between different agents. It acts as a central hub or a switchboard.
 
+import inspect
+from dataclasses import dataclass
+from typing import Any, Callable, Mapping
+
+@dataclass(frozen=True, slots=True)
+class Msg:
+    """A request sent over the bridge: which agent, which task, and the task's arguments."""
+    target: str
+    task: str
+    data: Mapping[str, Any]
+
 class AgentBridge:
     """
     A simple bridge for agent-to-agent (A2A) communication.
+    An agent exposes a task by defining a 'handle_<task>' method; the task's
+    data is passed to it as keyword arguments.
     """
+    HANDLER_PREFIX = "handle_"
+
     def __init__(self):
         """
-        Initializes the bridge with an empty dictionary to store registered agents.
+        Initializes the bridge with an empty (agent name, task) -> handler table.
         """
-        self._agents = {}
+        self._handlers: dict[tuple[str, str], Callable] = {}
+        self._agents: set[str] = set()
         print("[Bridge] Agent Communication Bridge initialized.")
 
     def register_agent(self, name: str, agent_instance):
         """
-        Registers an agent instance with a given name.
+        Registers an agent instance with a given name, binding all of its
+        'handle_<task>' methods up front so requests need a single lookup.
         """
-        self._agents[name] = agent_instance
+        self._agents.add(name)
+        for method_name, method in inspect.getmembers(agent_instance, inspect.ismethod):
+            if method_name.startswith(self.HANDLER_PREFIX):
+                self._handlers[(name, method_name[len(self.HANDLER_PREFIX):])] = method
         print(f"[Bridge] Agent '{name}' has been registered.")
 
-    def request(self, target_agent_name: str, task: str, data: dict) -> str:
+    def _lookup(self, msg: Msg):
+        """Returns (handler, None) for a message, or (None, error message)."""
+        handler = self._handlers.get((msg.target, msg.task))
+        if handler is not None:
+            return handler, None
+        if msg.target not in self._agents:
+            return None, f"Error: Agent '{msg.target}' not found."
+        return None, f"Error: Agent '{msg.target}' cannot handle task '{msg.task}'."
+
+    def request(self, msg: Msg):
+        """
+        Sends a request from one agent to another and returns the result.
+        Only synchronous handlers can be called this way; use request_async for coroutines.
+        """
+        print(f"[Bridge] Routing request to '{msg.target}' for task '{msg.task}'.")
+        handler, error = self._lookup(msg)
+        if error:
+            return error
+        if inspect.iscoroutinefunction(handler):
+            return f"Error: Task '{msg.task}' on '{msg.target}' is async. Use request_async."
+        return handler(**msg.data)
+
+    async def request_async(self, msg: Msg):
         """
-        Sends a request from one agent to another.
+        Sends a request from one agent to another from async code,
+        awaiting the handler if it is a coroutine.
         """
-        print(f"[Bridge] Routing request to '{target_agent_name}' for task '{task}'.")
-        if target_agent_name in self._agents:
-            target_agent = self._agents[target_agent_name]
-            if hasattr(target_agent, 'handle_request'):
-                # This calls the specific handler method on the target agent
-                return target_agent.handle_request(task, data)
-            else:
-                return f"Error: Agent '{target_agent_name}' cannot handle requests."
-        else:
-            return f"Error: Agent '{target_agent_name}' not found."
+        print(f"[Bridge] Routing async request to '{msg.target}' for task '{msg.task}'.")
+        handler, error = self._lookup(msg)
+        if error:
+            return error
+        if inspect.iscoroutinefunction(handler):
+            return await handler(**msg.data)
+        return handler(**msg.data)
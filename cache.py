@@ -0,0 +1,151 @@
+# cache.py
+# This file provides response caches so repeated questions and lookups can be
+# answered without another round-trip to Gemini or the data APIs.
+
+import os
+import orjson
+import asyncio
+import hashlib
+import functools
+import threading
+from cachetools import TTLCache
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+_redis_client = None
+
+def _get_redis():
+    """Returns a shared Redis client if REDIS_URL is configured, otherwise None."""
+    global _redis_client
+    url = os.getenv("REDIS_URL")
+    if not url:
+        return None
+    if redis is None:
+        print("🟡 WARNING: REDIS_URL is set but the 'redis' package is not installed. Using in-process cache.")
+        return None
+    if _redis_client is None:
+        _redis_client = redis.Redis.from_url(url)
+    return _redis_client
+
+def make_key(*parts) -> str:
+    """Builds a cache key from the normalized (lower-cased, whitespace-collapsed) parts."""
+    normalized = "\x1f".join(" ".join(str(part).lower().split()) for part in parts)
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+_UNRESOLVED = object()
+
+class ResponseCache:
+    """
+    A TTL + LRU cache for JSON-serializable responses.
+    Entries live in-process by default. If REDIS_URL is set they are stored in
+    Redis instead, so several server workers share one cache.
+    """
+    def __init__(self, name: str, ttl: int, maxsize: int = 1024):
+        self.name = name
+        self.ttl = ttl
+        self._local = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        # Resolved on first use: caches are often created at import time (e.g. by
+        # decorators), before load_dotenv() has put REDIS_URL into the environment.
+        self._redis = _UNRESOLVED
+
+    def _backend(self):
+        """Returns the Redis client to use, or None for the in-process cache."""
+        if self._redis is _UNRESOLVED:
+            self._redis = _get_redis()
+        return self._redis
+
+    async def get(self, key: str):
+        """Returns the cached value for a key, or None on a miss."""
+        backend = self._backend()
+        if backend is not None:
+            try:
+                raw = await asyncio.to_thread(backend.get, f"kisan:{self.name}:{key}")
+            except redis.RedisError as e:
+                print(f"🟡 WARNING: Redis cache read failed: {e}")
+                return None
+            return orjson.loads(raw) if raw is not None else None
+        with self._lock:
+            return self._local.get(key)
+
+    async def set(self, key: str, value):
+        """Stores a value under a key for the cache's TTL."""
+        backend = self._backend()
+        if backend is not None:
+            try:
+                await asyncio.to_thread(backend.setex, f"kisan:{self.name}:{key}", self.ttl, orjson.dumps(value))
+            except redis.RedisError as e:
+                print(f"🟡 WARNING: Redis cache write failed: {e}")
+            return
+        with self._lock:
+            self._local[key] = value
+
+def cached_llm(ttl: int = 3600, maxsize: int = 256, cache_if=None):
+    """
+    Caches an agent method's answer, keyed on its normalized arguments.
+    Only use it for answers that do not depend on live data. If cache_if is
+    given, only results for which it returns True are stored.
+    """
+    def decorator(method):
+        cache = ResponseCache(method.__qualname__, ttl, maxsize)
+
+        @functools.wraps(method)
+        async def wrapper(self, *args, **kwargs):
+            key = make_key(*args, *sorted(kwargs.items()))
+            cached = await cache.get(key)
+            if cached is not None:
+                print(f"⚡ Cache hit for {method.__qualname__}.")
+                return cached
+            result = await method(self, *args, **kwargs)
+            if result is not None and (cache_if is None or cache_if(result)):
+                await cache.set(key, result)
+            return result
+        return wrapper
+    return decorator
+
+_MISSING = object()
+
+def async_ttl_cache(ttl: int, maxsize: int = 256, key=None, cache_if=None):
+    """
+    Caches an async function's results in-process for ttl seconds.
+    key(*args, **kwargs) builds the cache key (defaults to the arguments themselves),
+    and if cache_if is given only results for which it returns True are stored.
+    Concurrent calls with the same key share a single in-flight call.
+    """
+    def decorator(func):
+        cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        lock = threading.Lock()
+        # Tasks can only be awaited on their own event loop, so in-flight calls are
+        # tracked per (loop, key).
+        in_flight = {}
+
+        def finish(flight_key, task):
+            in_flight.pop(flight_key, None)
+            if task.cancelled() or task.exception() is not None:
+                return
+            result = task.result()
+            if cache_if is None or cache_if(result):
+                with lock:
+                    cache[flight_key[1]] = result
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            cache_key = key(*args, **kwargs) if key else (args, tuple(sorted(kwargs.items())))
+            with lock:
+                result = cache.get(cache_key, _MISSING)
+            if result is not _MISSING:
+                return result
+
+            flight_key = (asyncio.get_running_loop(), cache_key)
+            task = in_flight.get(flight_key)
+            if task is None:
+                task = asyncio.ensure_future(func(*args, **kwargs))
+                in_flight[flight_key] = task
+                task.add_done_callback(functools.partial(finish, flight_key))
+            # Shield so one caller being cancelled does not cancel the shared call
+            return await asyncio.shield(task)
+        return wrapper
+    return decorator
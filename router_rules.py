@@ -0,0 +1,66 @@
+# router_rules.py
+# This file holds the rule-based fast path of the query router. Queries that clearly
+# match one agent are routed locally with precompiled patterns; anything ambiguous
+# returns None so the LLM router decides.
+
+import re
+
+GENERAL_RESPONSE = "You're welcome! Let me know if you have more questions."
+
+_TIME_SUFFIX = r"(?:\s+(?:today|tomorrow|now|this\s+week|next\s+week))?\s*[?.!]*\s*$"
+
+# Words that may precede or follow a place/commodity name but are not part of it
+_LEADING_WORDS = {"the", "my", "our"}
+_TRAILING_WORDS = {"mandi", "market", "apmc", "yard", "district", "city", "town"}
+# Words that show the captured text is not a place or commodity name at all
+# (times, seasons, or a second "in ..." clause), so the LLM should decide instead.
+_REJECT_WORDS = {
+    "in", "at", "on", "for", "of", "and", "or", "is", "are", "will", "be",
+    "today", "tomorrow", "tonight", "now", "yesterday",
+    "morning", "afternoon", "evening", "night", "day", "days",
+    "week", "weekend", "month", "year", "season", "time",
+    "kharif", "rabi", "zaid", "summer", "winter", "monsoon", "rainy",
+    "soil", "field", "farm", "village", "area", "region",
+}
+_MAX_NAME_WORDS = 3
+
+def _clean_name(text: str):
+    """
+    Normalizes a captured place or commodity name. Returns None unless what is
+    left is 1-3 plain words, none of which are on the reject list.
+    """
+    words = text.replace(".", " ").lower().split()
+    while words and words[0] in _LEADING_WORDS:
+        words.pop(0)
+    while words and words[-1] in _TRAILING_WORDS:
+        words.pop()
+    if not 1 <= len(words) <= _MAX_NAME_WORDS or any(word in _REJECT_WORDS for word in words):
+        return None
+    return " ".join(words).title()
+
+# Each rule is (pattern, agent, parameter extractor); the first rule that matches
+# and yields all of its parameters wins.
+ROUTER_RULES = [
+    (re.compile(r"^\s*(?:thanks?|thank\s+you(?:\s+(?:so|very)\s+much)?|ok(?:ay)?|bye|good\s*bye)(?:\s+(?:bye|thanks?))?[\s.!]*$", re.I),
+     "General", lambda m, q: {"response": GENERAL_RESPONSE}),
+    (re.compile(r"\b(?:price|prices|rate|rates)\s+(?:of\s+|for\s+)?(?P<commodity>[a-z][a-z ]*?)\s+in\s+(?P<market>[a-z][a-z .]*?)" + _TIME_SUFFIX, re.I),
+     "MarketAgent", lambda m, q: {"commodity": _clean_name(m["commodity"]), "market": _clean_name(m["market"])}),
+    (re.compile(r"\b(?:weather|rain|rainfall|temperature|forecast|humidity)\b.*?\bin\s+(?P<city>[a-z][a-z .]*?)" + _TIME_SUFFIX, re.I),
+     "WeatherAgent", lambda m, q: {"city": _clean_name(m["city"])}),
+    (re.compile(r"\b(?:pm[\s-]?kisan|schemes?|subsid(?:y|ies))\b", re.I),
+     "SchemeAgent", lambda m, q: {"query": q.strip()}),
+    (re.compile(r"\b(?:my\s+soil|soil\s+is)\b", re.I),
+     "SoilAgent", lambda m, q: {"query": q.strip()}),
+    (re.compile(r"\b(?:organic|compost|vermicompost)\b", re.I),
+     "OrganicAgent", lambda m, q: {"topic": q.strip()}),
+]
+
+def quick_route(query: str):
+    """Routes the query with ROUTER_RULES. Returns None if no rule decides it."""
+    for pattern, agent_name, extract in ROUTER_RULES:
+        match = pattern.search(query)
+        if match:
+            params = extract(match, query)
+            if all(params.values()):
+                return {"agent": agent_name, "parameters": params}
+    return None
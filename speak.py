@@ -1,7 +1,12 @@
 # Import the necessary libraries
 from gtts import gTTS
 from playsound import playsound
-import os
+from pathlib import Path
+import hashlib
+
+# Synthesized clips are kept here, so each (language, text) pair is fetched from
+# Google's TTS service only once and replayed straight from disk afterwards.
+CACHE_DIR = Path.home() / ".cache" / "kisan" / "tts"
 
 def speak(text_to_speak, language_code):
     """
@@ -10,32 +15,33 @@ def speak(text_to_speak, language_code):
     'te' = Telugu
     'kn' = Kannada
     """
-    print(f"Preparing to speak in language '{language_code}'...")
-    
-    # Create the text-to-speech object
-    tts = gTTS(text=text_to_speak, lang=language_code, slow=False)
-    
-    # Save the audio to a temporary file named 'voice.mp3'
-    audio_file = "voice.mp3"
-    tts.save(audio_file)
-    
+    key = hashlib.sha1(f"{language_code}:{text_to_speak}".encode('utf-8')).hexdigest()
+    audio_file = CACHE_DIR / f"{key}.mp3"
+
+    if not audio_file.exists():
+        print(f"Preparing to speak in language '{language_code}'...")
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        # Create the text-to-speech object and save it under a temporary name,
+        # so an interrupted download never leaves a broken file in the cache
+        tts = gTTS(text=text_to_speak, lang=language_code, slow=False)
+        partial_file = audio_file.with_suffix(".part")
+        tts.save(str(partial_file))
+        partial_file.replace(audio_file)
+
     # Play the audio file
-    playsound(audio_file)
-    
-    # Clean up by deleting the temporary audio file
-    os.remove(audio_file)
+    playsound(str(audio_file))
 
 
 # --- Let's use the function for both languages ---
-
-# 1. Speak in Telugu
-telugu_text = "మీకు స్వాగతం"
-speak(telugu_text, 'te')
+if __name__ == "__main__":
+    # 1. Speak in Telugu
+    telugu_text = "మీకు స్వాగతం"
+    speak(telugu_text, 'te')
 
 
-# 2. Speak in Kannada
-kannada_text = "ನಿಮಗೆ ಸ್ವಾಗತ"
-speak(kannada_text, 'kn')
+    # 2. Speak in Kannada
+    kannada_text = "ನಿಮಗೆ ಸ್ವಾಗತ"
+    speak(kannada_text, 'kn')
 
 
-print("\nFinished speaking both languages.")
\ No newline at end of file
+    print("\nFinished speaking both languages.")
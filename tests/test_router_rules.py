@@ -0,0 +1,32 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from router_rules import GENERAL_RESPONSE, quick_route
+
+ROUTING_TABLE = [
+    # Clear queries are routed locally with cleaned parameters
+    ("weather in hyderabad?", {"agent": "WeatherAgent", "parameters": {"city": "Hyderabad"}}),
+    ("Will it rain in Guntur tomorrow", {"agent": "WeatherAgent", "parameters": {"city": "Guntur"}}),
+    ("temperature in the Nizamabad district", {"agent": "WeatherAgent", "parameters": {"city": "Nizamabad"}}),
+    ("weather in Hyderabad city", {"agent": "WeatherAgent", "parameters": {"city": "Hyderabad"}}),
+    ("price of paddy in Karimnagar district", {"agent": "MarketAgent", "parameters": {"commodity": "Paddy", "market": "Karimnagar"}}),
+    ("What is the price of potato in Agra?", {"agent": "MarketAgent", "parameters": {"commodity": "Potato", "market": "Agra"}}),
+    ("price of onion in Agra mandi", {"agent": "MarketAgent", "parameters": {"commodity": "Onion", "market": "Agra"}}),
+    ("rates of green chilli in the Guntur market today", {"agent": "MarketAgent", "parameters": {"commodity": "Green Chilli", "market": "Guntur"}}),
+    ("thank you", {"agent": "General", "parameters": {"response": GENERAL_RESPONSE}}),
+    # Captures that are times, seasons or a second "in ..." clause are left to the LLM
+    ("Is it going to rain in the evening", None),
+    ("How much rainfall in kharif in Telangana", None),
+    ("what is the temperature in the soil in summer", None),
+    ("price of onion today in agra", None),
+    ("what will the weather be like in my village over the next few days", None),
+    ("Hyderabad", None),
+]
+
+@pytest.mark.parametrize("query, expected", ROUTING_TABLE)
+def test_quick_route(query, expected):
+    assert quick_route(query) == expected
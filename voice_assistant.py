@@ -3,28 +3,53 @@
 
 import os
 import asyncio
-import json
+import orjson
 import re
+import sys
 import speech_recognition as sr
 import pyttsx3  # Using the offline pyttsx3 library
 from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor
 
 # Import all the existing logic from your project
 from bridge import AgentBridge
 from all_agents import CropAgent, MarketAgent, SchemeAgent, WeatherAgent, OrganicAgent, SoilAgent
-from api_helpers import call_gemini_api
+from api_helpers import ROUTER_RESPONSE_SCHEMA, call_gemini_api
+from cache import ResponseCache, make_key
 
 # --- Initialization ---
 load_dotenv()
 
+def _init_tts_thread():
+    """SAPI5 (Windows) is a COM API, so COM must be initialized on the thread that uses it."""
+    if sys.platform == "win32":
+        import pythoncom
+        pythoncom.CoInitialize()
+
+# pyttsx3 engines are not thread-safe, and on Windows they only work on the thread that
+# created them. Every engine is therefore created and driven on this one TTS thread,
+# which also serializes speech without any locks.
+_tts_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tts", initializer=_init_tts_thread)
+
 # Initialize the offline TTS engine
 try:
-    engine = pyttsx3.init()
+    engine = _tts_executor.submit(pyttsx3.init).result()
 except Exception as e:
     print(f"🔴 CRITICAL ERROR: Could not initialize pyttsx3 engine: {e}")
     print("Please ensure your OS has a working speech synthesis engine (like SAPI5, NSSpeech, or eSpeak).")
     exit()
 
+# One pre-warmed engine per voice, so switching languages never reloads the synthesizer.
+# Only SAPI5 (Windows) and NSSpeech (macOS) engines are independent of each other.
+# eSpeak delivers its end-of-utterance callback to the most recently created engine
+# only, so there a single engine is kept and the voice is switched on it instead.
+_ENGINE_PER_VOICE = sys.platform in ("win32", "darwin")
+# Maps voice_id -> engine; None is the default engine. Only touched on the TTS thread.
+_engines = {None: engine}
+# The voice id last selected on each engine. Tracked here because eSpeak's
+# getProperty('voice') returns the voice name rather than its id.
+_engine_voices = {engine: None}
+
 # Initialize the agent bridge and all agents
 bridge = AgentBridge()
 agents = {
@@ -39,43 +64,107 @@ for name, agent in agents.items():
     bridge.register_agent(name, agent)
 
 # --- A more robust function to clean text for speech ---
+# All strip rules are combined into one pattern compiled at import, so each utterance
+# is scanned once. Alternatives, in order: list markers at the start of a line (also
+# when wrapped in markdown, e.g. "**1.**"), parenthetical asides, markdown characters.
+_SPEECH_STRIP = re.compile(r'^[\s*_`#]*[\d.\-*]+\s*|\s*\([^)]*\)|[*_`#]', re.MULTILINE)
+_WHITESPACE = re.compile(r'\s+')
+
 def clean_text_for_speech(text):
     """A more aggressive function to remove markdown and non-language characters."""
     if not isinstance(text, str):
         return ""
     
-    text = re.sub(r'\s*\([^)]*\)', '', text)
-    text = re.sub(r'[\*_`#]', '', text)
-    text = re.sub(r'^\s*[\d\.\-\*]+\s*', '', text, flags=re.MULTILINE)
-    text = text.replace('₹', 'rupees')
-    text = re.sub(r'\s+', ' ', text).strip()
-    
-    return text
+    text = _SPEECH_STRIP.sub('', text).replace('₹', 'rupees')
+    return _WHITESPACE.sub(' ', text).strip()
 
 # --- Voice Functions (using offline pyttsx3) ---
 
-def speak(text, voice_id=None):
-    """Converts text to speech using the offline pyttsx3 engine."""
-    try:
-        clean_text = clean_text_for_speech(text)
-        
-        if not clean_text:
-            print("WARNING: No text left to speak after cleaning.")
-            return
-
-        print(f"🤖 Kisan Mitra says: {text}")
+def _create_engines(voice_ids):
+    """Runs on the TTS thread. Creates one engine per voice id with that voice already selected."""
+    if not _ENGINE_PER_VOICE:
+        return
+    for voice_id in voice_ids:
+        if voice_id in _engines:
+            continue
+        try:
+            voice_engine = pyttsx3.Engine()
+            voice_engine.setProperty('voice', voice_id)
+            _engines[voice_id] = voice_engine
+            _engine_voices[voice_engine] = voice_id
+        except Exception as e:
+            print(f"🟡 WARNING: Could not pre-load voice '{voice_id}', it will be set per utterance. Error: {e}")
 
-        # Set the voice if a specific ID is provided
-        if voice_id:
-            engine.setProperty('voice', voice_id)
+def prewarm_engines(voice_ids):
+    """Creates one engine per voice id up front, on the TTS thread, where the driver allows it."""
+    _tts_executor.submit(_create_engines, list(voice_ids)).result()
 
-        engine.say(clean_text)
-        engine.runAndWait() # Blocks while speaking
+def _prepare_speech(text):
+    """Returns the text cleaned for speech (and echoes it), or None if nothing is left to say."""
+    clean_text = clean_text_for_speech(text)
+    if not clean_text:
+        print("WARNING: No text left to speak after cleaning.")
+        return None
+    print(f"🤖 Kisan Mitra says: {text}")
+    return clean_text
 
+def _say(clean_text, voice_id):
+    """Runs on the TTS thread. Speaks already-cleaned text with the voice's engine."""
+    try:
+        voice_engine = _engines.get(voice_id, _engines[None])
+        # Selecting a voice reloads it in the synthesizer, so only do so on a switch
+        if voice_id and _engine_voices.get(voice_engine) != voice_id:
+            voice_engine.setProperty('voice', voice_id)
+            _engine_voices[voice_engine] = voice_id
+        voice_engine.say(clean_text)
+        voice_engine.runAndWait()
     except Exception as e:
         print(f"Sorry, I couldn't speak. Error: {e}")
 
-def listen(lang_code='en-US'):
+def speak(text, voice_id=None):
+    """Converts text to speech using the offline pyttsx3 engine. Blocks while speaking."""
+    clean_text = _prepare_speech(text)
+    if clean_text:
+        _tts_executor.submit(_say, clean_text, voice_id).result()
+
+async def speak_async(text, voice_id=None):
+    """Speaks on the TTS thread so the event loop is not blocked while talking."""
+    clean_text = _prepare_speech(text)
+    if clean_text:
+        await asyncio.get_running_loop().run_in_executor(_tts_executor, _say, clean_text, voice_id)
+
+# Sentence boundaries: whitespace after ., !, ? or the Devanagari danda (but not after a
+# list number like "1."), and line breaks.
+_SENTENCE_END = re.compile(r'(?<=\D[.!?।])\s+|\n+')
+
+async def speak_stream(chunks, voice_id=None):
+    """
+    Speaks a streamed response sentence by sentence. The LLM stream (producer) and
+    the TTS worker (consumer) are connected by a queue, so speech starts with the
+    first complete sentence while the rest is still being generated.
+    """
+    sentences = asyncio.Queue()
+
+    async def tts_worker():
+        while (sentence := await sentences.get()) is not None:
+            await speak_async(sentence, voice_id)
+
+    worker = asyncio.create_task(tts_worker())
+    buffer = ""
+    try:
+        async for chunk in chunks:
+            buffer += chunk
+            *complete, buffer = _SENTENCE_END.split(buffer)
+            for sentence in complete:
+                if clean_text_for_speech(sentence):
+                    await sentences.put(sentence)
+        if clean_text_for_speech(buffer):
+            await sentences.put(buffer)
+    finally:
+        await sentences.put(None)
+        await worker
+
+def listen(lang_code='en-US', voice_id=None):
     """Listens for voice input from the user and converts it to text."""
     r = sr.Recognizer()
     with sr.Microphone() as source:
@@ -90,10 +179,10 @@ def listen(lang_code='en-US'):
         print(f"👤 You said: {query}\n")
         return query
     except sr.UnknownValueError:
-        speak("Sorry, I did not understand that.")
+        speak("Sorry, I did not understand that.", voice_id=voice_id)
         return None
     except sr.RequestError as e:
-        speak(f"Could not request results from the speech recognition service; {e}")
+        speak(f"Could not request results from the speech recognition service; {e}", voice_id=voice_id)
         return None
     except Exception as e:
         print(f"An error occurred: {e}")
@@ -103,7 +192,7 @@ def discover_voices():
     """Discovers and maps available voices on the system."""
     print("🔊 Discovering available voices on your system...")
     available_voices = {}
-    voices = engine.getProperty('voices')
+    voices = _tts_executor.submit(engine.getProperty, 'voices').result()
     for voice in voices:
         try:
             # The lang attribute can be a list, so we take the first one
@@ -121,21 +210,34 @@ def discover_voices():
     return available_voices
 
 # --- AI Router ---
+# Router decisions for identical (normalized) queries are reused for an hour.
+router_cache = ResponseCache("voice_router", ttl=3600)
+
+ROUTER_PROMPT = """
+You are an intelligent router for an agricultural AI assistant. Your job is to analyze a farmer's query, identify the correct agent, and extract all necessary parameters.
+Your response must be a JSON object.
+Examples:
+- Query: "weather in hyderabad" -> {"agent": "WeatherAgent", "parameters": {"city": "Hyderabad"}}
+- Query: "What is the price of potato in Agra?" -> {"agent": "MarketAgent", "parameters": {"commodity": "Potato", "market": "Agra"}}
+"""
+ROUTER_QUERY_TEMPLATE = 'The user\'s query is: "{query}"'
+
 async def route_query_to_agent(query: str, lang: str):
     """Uses an LLM to analyze the user's query and determine the correct agent."""
-    prompt = f"""
-    You are an intelligent router for an agricultural AI assistant. Your job is to analyze a farmer's query, identify the correct agent, and extract all necessary parameters.
-    The user's query is: "{query}"
-    Your response must be a JSON object.
-    Examples:
-    - Query: "weather in hyderabad" -> {{"agent": "WeatherAgent", "parameters": {{"city": "Hyderabad"}}}}
-    - Query: "What is the price of potato in Agra?" -> {{"agent": "MarketAgent", "parameters": {{"commodity": "Potato", "market": "Agra"}}}}
-    """
-    response_text = await call_gemini_api(prompt)
+    cache_key = make_key(query, lang)
+    cached = await router_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    prompt = ROUTER_QUERY_TEMPLATE.format_map({"query": query})
+    response_text = await call_gemini_api(prompt, system_prompt=ROUTER_PROMPT,
+                                          response_schema=ROUTER_RESPONSE_SCHEMA, temperature=0)
     try:
-        json_str = response_text.strip().replace("```json", "").replace("```", "")
-        return json.loads(json_str)
-    except (json.JSONDecodeError, AttributeError):
+        parsed_json = orjson.loads(response_text)
+        # "Unclear" is a non-answer; let the query be routed afresh next time.
+        if parsed_json.get("agent") != "Unclear":
+            await router_cache.set(cache_key, parsed_json)
+        return parsed_json
+    except orjson.JSONDecodeError:
         return {"agent": "Unclear", "parameters": {}}
 
 # --- Main Application Logic ---
@@ -170,6 +272,8 @@ async def main():
             exit()
 
 
+    prewarm_engines(lang['voice_id'] for lang in display_map.values())
+
     print("\nPlease select an available language:")
     for key, lang in display_map.items():
         print(f"{key}. {lang['name']}")
@@ -182,14 +286,14 @@ async def main():
     voice_id = selected_lang["voice_id"]
 
     welcome_message = "Welcome! I am your Kisan Mitra. How can I assist you?"
-    speak(welcome_message, voice_id=voice_id)
+    await speak_async(welcome_message, voice_id=voice_id)
 
     while True:
-        user_query = listen(lang_code=rec_code)
+        user_query = listen(lang_code=rec_code, voice_id=voice_id)
 
         if user_query:
             if any(word in user_query.lower() for word in ["exit", "quit", "stop"]):
-                speak("Goodbye!", voice_id=voice_id)
+                await speak_async("Goodbye!", voice_id=voice_id)
                 break
 
             routing_info = await route_query_to_agent(user_query, lang_name)
@@ -201,10 +305,11 @@ async def main():
                 # Agent logic remains the same
                 target_agent = agents[agent_name]
                 if agent_name == "CropAgent":
-                    speak("Please tell me the full path to the crop image on your computer.", voice_id=voice_id)
+                    await speak_async("Please tell me the full path to the crop image on your computer.", voice_id=voice_id)
                     image_path = input("Enter image path here: ")
                     if os.path.exists(image_path):
-                        result = await target_agent.diagnose(image_path, lang_name)
+                        await speak_stream(target_agent.diagnose_stream(image_path, lang_name), voice_id=voice_id)
+                        continue
                     else:
                         result = "Sorry, I could not find that file."
                 else: # Simplified handling for other agents
@@ -213,7 +318,7 @@ async def main():
             else:
                 result = "I'm sorry, I'm not sure how to help with that. Could you please rephrase your question?"
             
-            speak(result, voice_id=voice_id)
+            await speak_async(result, voice_id=voice_id)
 
 if __name__ == "__main__":
     try: